@@ -0,0 +1,297 @@
+"""
+Shared helpers for the DoomWiki + Gemini scripts.
+
+Used by add_images_from_doomwiki.py, extract_doomwiki_images.py, and
+extract_wad_metadata.py: HTTP fetching (pooled sync session and async
+aiohttp), HTML reduction, the image-extraction prompt/schema, the local
+response cache, and the Gemini client/context-cache plumbing.
+
+Not a standalone script - dependencies are declared by the importing scripts.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+import orjson
+import requests
+from google import genai
+from google.genai import errors, types
+from requests.adapters import HTTPAdapter
+from selectolax.parser import HTMLParser
+
+CACHE_DIR = Path(__file__).parent / ".gemini_cache"
+
+MODEL = "gemini-3-flash-preview"
+CACHE_TTL = "3600s"
+FETCH_CONCURRENCY = 16
+MAX_RETRIES = 5
+
+# Bump to invalidate all cached extraction results after a prompt change
+PROMPT_VERSION = "v3"
+
+# Shared session: connections (and TLS handshakes) are pooled per process
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "rusted-doom-launcher/1.0"
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+PROMPT = """Analyze this DoomWiki HTML page and extract all relevant images.
+
+Return a JSON object with this structure:
+{
+  "title": "WAD title from the page",
+  "images": [
+    {
+      "type": "title_screen" | "screenshot" | "credits" | "intermission" | "other",
+      "url": "full URL to the image (use doomwiki.org domain)",
+      "caption": "description if available"
+    }
+  ]
+}
+
+Rules:
+1. Only include content images (title screens, screenshots, credits, intermission screens)
+2. SKIP: wiki logos, icons, cacoward badges, blank.gif, navigation images, Patreon icons
+3. Convert relative URLs to absolute (prefix with https://doomwiki.org)
+4. Use the full-size image URL, not thumbnails (remove /thumb/ and size suffix like /320px-)
+5. If no content images found, return empty images array"""
+
+
+# Response schema enforced by Gemini's JSON output mode
+IMAGES_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "images": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "type": {
+                        "type": "STRING",
+                        "enum": ["title_screen", "screenshot", "credits", "intermission", "other"],
+                    },
+                    "url": {"type": "STRING"},
+                    "caption": {"type": "STRING"},
+                },
+                "required": ["type", "url"],
+            },
+        },
+    },
+    "required": ["title", "images"],
+}
+
+
+def reduce_html(html: str) -> str:
+    """Strip a wiki page down to its content body before sending to Gemini.
+
+    Keeps #mw-content-text (the MediaWiki article body, including the <img>
+    tags the prompts need) and drops scripts, styles, navboxes, the TOC, and
+    edit links, cutting input tokens by roughly an order of magnitude.
+    """
+    tree = HTMLParser(html)
+    node = tree.css_first("#mw-content-text") or tree.body
+    if node is None:
+        return html
+    for selector in ("script", "style", ".navbox", "#toc", ".mw-editsection"):
+        for tag in node.css(selector):
+            tag.decompose()
+    return node.html or html
+
+
+def fetch_page(url: str) -> str:
+    """Fetch HTML content from URL (synchronous, pooled session)."""
+    response = SESSION.get(url, timeout=30)
+    response.raise_for_status()
+    return reduce_html(response.text)
+
+
+async def fetch_page_async(
+    session: aiohttp.ClientSession, url: str, sem: asyncio.Semaphore
+) -> str | None:
+    """Fetch HTML content from URL, limited by the shared semaphore."""
+    try:
+        async with sem:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                response.raise_for_status()
+                return reduce_html(await response.text())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"  Error fetching {url}: {e}", file=sys.stderr)
+        return None
+
+
+def cache_key(prompt: str, text: str) -> str:
+    """Disk-cache key for one (task, input) pair.
+
+    The prompt is part of the key: the cache dir is shared by several
+    extractions (images, links, summaries, metadata), and the same page HTML
+    must not return another task's result.
+    """
+    return hashlib.sha256((PROMPT_VERSION + prompt + text).encode()).hexdigest()
+
+
+def cache_get(key: str) -> dict | None:
+    """Return a previously extracted result for this key, if any."""
+    path = CACHE_DIR / f"{key}.json"
+    if path.exists():
+        return orjson.loads(path.read_bytes())
+    return None
+
+
+def cache_put(key: str, result: dict) -> None:
+    """Store an extracted result atomically (tmp + rename)."""
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp = CACHE_DIR / f"{key}.tmp"
+    tmp.write_bytes(orjson.dumps(result))
+    os.replace(tmp, CACHE_DIR / f"{key}.json")
+
+
+_GENAI_CLIENT = None
+
+
+def _client() -> genai.Client:
+    """Construct the Gemini client once and reuse it across calls."""
+    global _GENAI_CLIENT
+    if _GENAI_CLIENT is None:
+        _GENAI_CLIENT = genai.Client()
+    return _GENAI_CLIENT
+
+
+# Prompt -> server-side cache name, created lazily. The lock serializes
+# check-then-create: concurrent to_thread callers (subpage summaries) would
+# otherwise each create an orphan server-side cache for the same prompt
+_caches: dict[str, str] = {}
+_caches_lock = threading.Lock()
+
+# These scripts are offline batch jobs, so requests go out on the Flex
+# service tier: half the price of Standard, in exchange for occasional
+# sheddable preemptions (which the 429 backoff below absorbs)
+_FLEX_TIER = types.HttpOptions(headers={"x-service-tier": "flex"})
+
+
+def cached_generate(client: genai.Client, prompt: str, contents: str, schema: dict) -> str:
+    """Generate content with the fixed prompt stored in an explicit context cache.
+
+    The prompt is uploaded once and referenced by cache name on every call, so
+    cached-prefix tokens are billed at a 90% discount and skip re-tokenization.
+    The response is streamed and accumulated chunk by chunk, so decode overlaps
+    generation instead of waiting for the full (often multi-KB) body; returns
+    the response text. Requests run on the Flex tier (50% cheaper, may be
+    shed under load); the cache is recreated if its TTL has expired, and
+    rate-limit errors (429) are retried with exponential backoff.
+    """
+    recreated = False
+    for attempt in range(MAX_RETRIES):
+        with _caches_lock:
+            name = _caches.get(prompt)
+            if name is None:
+                cache = client.caches.create(
+                    model=MODEL,
+                    config=types.CreateCachedContentConfig(system_instruction=prompt, ttl=CACHE_TTL),
+                )
+                name = _caches[prompt] = cache.name
+        try:
+            chunks = []
+            for chunk in client.models.generate_content_stream(
+                model=MODEL,
+                contents=[contents],
+                config=types.GenerateContentConfig(
+                    temperature=0.1,  # Low temperature for consistent extraction
+                    cached_content=name,
+                    response_mime_type="application/json",
+                    response_schema=schema,
+                    http_options=_FLEX_TIER,
+                ),
+            ):
+                if chunk.text:
+                    chunks.append(chunk.text)
+            return "".join(chunks).strip()
+        except errors.ClientError as e:
+            if e.code == 429:
+                # Rate limited: back off, or give up loudly once out of retries
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                time.sleep(2**attempt)
+                continue
+            if recreated or attempt == MAX_RETRIES - 1:
+                raise
+            # Cache likely expired; drop it and retry with a fresh one
+            recreated = True
+            with _caches_lock:
+                if _caches.get(prompt) == name:
+                    _caches.pop(prompt)
+
+
+_THUMB_RE = re.compile(r"/thumb/(.+?)/\d+px-[^/]+$")
+# Known UI assets only - bare substrings like "icon" or "logo" would drop
+# real screenshots (Icon of Sin fights, title screens with logos)
+_SKIP_IMAGE_RE = re.compile(
+    r"blank\.gif|cacoward|patreon|poweredby|wiki_logo|site-logo", re.IGNORECASE
+)
+
+
+def _classify_image(src: str, caption: str) -> str:
+    """Heuristic image type from filename/caption; mirrors the prompt's types."""
+    text = f"{src} {caption}".lower()
+    if "title" in text:
+        return "title_screen"
+    if "intermission" in text:
+        return "intermission"
+    if "credit" in text:
+        return "credits"
+    return "screenshot"
+
+
+def extract_images_fast(html: str) -> dict:
+    """Deterministically extract images from the MediaWiki markup.
+
+    DoomWiki image placement is highly regular (.thumbinner, .infobox, and
+    a.image inside the content body), so most pages need no LLM call at all.
+    Returns the same shape as extract_images; an empty images list means the
+    caller should fall back to Gemini.
+    """
+    tree = HTMLParser(html)
+    images = []
+    seen = set()
+
+    for selector in (".thumbinner img", ".infobox img", "a.image img"):
+        for img in tree.css(selector):
+            src = img.attributes.get("src") or ""
+            if not src or _SKIP_IMAGE_RE.search(src):
+                continue
+            # /w/images/thumb/X/Y/name/320px-name -> /w/images/X/Y/name
+            src = _THUMB_RE.sub(r"/\1", src)
+            if src.startswith("//"):
+                src = f"https:{src}"
+            elif src.startswith("/"):
+                src = f"https://doomwiki.org{src}"
+            if src in seen:
+                continue
+            seen.add(src)
+            caption = img.attributes.get("alt") or ""
+            images.append(
+                {"type": _classify_image(src, caption), "url": src, "caption": caption}
+            )
+
+    return {"title": "", "images": images}
+
+
+def extract_images(html: str) -> dict:
+    """Use Gemini to extract image data from HTML."""
+    client = _client()
+
+    text = cached_generate(client, PROMPT, f"HTML content:\n\n{html}", IMAGES_SCHEMA)
+
+    # JSON output mode guarantees valid JSON; no fence stripping needed
+    if text:
+        return orjson.loads(text)
+
+    return {"title": "", "images": []}
@@ -2,13 +2,20 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
+#     "aiohttp",
 #     "google-genai",
+#     "orjson",
 #     "requests",
+#     "selectolax",
 # ]
 # ///
 """
 Add images to WAD entries by extracting them from DoomWiki pages using Gemini 3 Flash.
 
+Uses the Gemini Batch API: all pages are submitted as one batch job (async,
+completes within 24h, 50% cheaper and with much higher rate limits than
+per-request calls), then results are streamed back and applied to the entries.
+
 Usage:
     uv run scripts/add_images_from_doomwiki.py
     uv run scripts/add_images_from_doomwiki.py --limit 10
@@ -16,110 +23,175 @@ Usage:
 """
 
 import argparse
-import json
-import sys
+import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import requests
+import aiohttp
+import orjson
 from google import genai
 from google.genai import types
 
+from _doomwiki_common import (
+    FETCH_CONCURRENCY,
+    IMAGES_SCHEMA,
+    MODEL,
+    PROMPT,
+    _client,
+    cache_get,
+    cache_key,
+    cache_put,
+    extract_images_fast,
+    fetch_page_async,
+)
+
 WADS_DIR = Path(__file__).parent.parent / "content" / "wads"
+BATCH_INPUT_FILE = Path(__file__).parent / "data" / "image_batch_requests.jsonl"
 
-PROMPT = """Analyze this DoomWiki HTML page and extract all relevant images.
+POLL_INTERVAL_SECONDS = 30
 
-Return a JSON object with this structure:
-{
-  "title": "WAD title from the page",
-  "images": [
-    {
-      "type": "title_screen" | "screenshot" | "credits" | "intermission" | "other",
-      "url": "full URL to the image (use doomwiki.org domain)",
-      "caption": "description if available"
-    }
-  ]
-}
-
-Rules:
-1. Only include content images (title screens, screenshots, credits, intermission screens)
-2. SKIP: wiki logos, icons, cacoward badges, blank.gif, navigation images, Patreon icons
-3. Convert relative URLs to absolute (prefix with https://doomwiki.org)
-4. Use the full-size image URL, not thumbnails (remove /thumb/ and size suffix like /320px-)
-5. If no content images found, return empty images array
-
-Return ONLY valid JSON, no markdown or explanation."""
-
-
-def fetch_page(url: str) -> str | None:
-    """Fetch HTML content from URL."""
-    try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"    Error fetching: {e}", file=sys.stderr)
-        return None
-
-
-def extract_images(html: str) -> dict:
-    """Use Gemini 3 Flash to extract image data from HTML."""
-    client = genai.Client()
-
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[f"HTML content:\n\n{html}\n\n{PROMPT}"],
-        config=types.GenerateContentConfig(
-            temperature=0.1,
-        ),
-    )
 
-    if response.candidates and response.candidates[0].content.parts:
-        text = response.candidates[0].content.parts[0].text
-        text = text.strip()
-        if text.startswith("```"):
-            text = text.split("\n", 1)[1]
-        if text.endswith("```"):
-            text = text.rsplit("```", 1)[0]
-        text = text.strip()
-        return json.loads(text)
+async def fetch_all(urls: dict[str, str]) -> dict[str, str | None]:
+    """Fetch all pages concurrently, returning slug -> HTML (or None)."""
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+    async with aiohttp.ClientSession() as session:
+        htmls = await asyncio.gather(
+            *[fetch_page_async(session, url, sem) for url in urls.values()]
+        )
+    return dict(zip(urls.keys(), htmls))
+
 
-    return {"title": "", "images": []}
+def get_doomwiki_url(entry: dict) -> str | None:
+    for url in entry.get("urls", []):
+        if "doomwiki.org" in url:
+            return url
+    return None
 
 
-def process_wad(filepath: Path, dry_run: bool = False) -> tuple[bool, str]:
-    """Process a single WAD entry.
+def build_batch(
+    wads_to_process: list[tuple[Path, dict]], use_cache: bool = True
+) -> tuple[dict[str, Path], dict[str, str], dict[str, dict]]:
+    """Phase 1: fetch every page concurrently, write one batch request per WAD.
 
-    Returns: (updated, message)
+    Takes (filepath, parsed entry) pairs as already loaded by main. Pages
+    resolved locally (response-cache hits or deterministic HTML parses) are
+    not queued. Writes a JSONL file (one Gemini request per line, keyed by
+    slug) and returns (slug -> filepath, slug -> cache key, locally
+    resolved results).
     """
-    entry = json.loads(filepath.read_text())
-    slug = entry.get("slug", filepath.stem)
+    BATCH_INPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    slug_to_file = {}
+    slug_to_url = {}
+    slug_to_key = {}
+    local_results = {}
+
+    for filepath, entry in wads_to_process:
+        slug = entry.get("slug", filepath.stem)
+        slug_to_file[slug] = filepath
+        slug_to_url[slug] = get_doomwiki_url(entry)
+
+    print(f"Fetching {len(slug_to_url)} pages...")
+    html_by_slug = asyncio.run(fetch_all(slug_to_url))
+
+    with BATCH_INPUT_FILE.open("wb") as f:
+        for i, (slug, html) in enumerate(html_by_slug.items(), 1):
+            print(f"[{i}/{len(html_by_slug)}] {slug}...", end=" ", flush=True)
+
+            if not html:
+                del slug_to_file[slug]
+                print("- Failed to fetch page")
+                continue
+
+            slug_to_key[slug] = cache_key(PROMPT, html)
+
+            if use_cache:
+                cached = cache_get(slug_to_key[slug])
+                if cached is not None:
+                    local_results[slug] = cached
+                    print("cached")
+                    continue
+
+            # Most pages are regular enough to parse without an LLM call;
+            # only the leftovers go into the batch
+            fast = extract_images_fast(html)
+            if fast["images"]:
+                local_results[slug] = fast
+                print("parsed")
+                continue
+
+            request = {
+                "key": slug,
+                "request": {
+                    "contents": [{"parts": [{"text": f"HTML content:\n\n{html}\n\n{PROMPT}"}]}],
+                    "generationConfig": {
+                        "temperature": 0.1,
+                        "responseMimeType": "application/json",
+                        "responseSchema": IMAGES_SCHEMA,
+                    },
+                },
+            }
+            f.write(orjson.dumps(request) + b"\n")
+            print("queued")
+
+    return slug_to_file, slug_to_key, local_results
+
+
+def submit_batch(client: genai.Client) -> list[dict]:
+    """Phase 2: submit the batch job, poll until done, return keyed results."""
+    uploaded = client.files.upload(
+        file=BATCH_INPUT_FILE,
+        config=types.UploadFileConfig(mime_type="jsonl"),
+    )
 
-    # Get DoomWiki URL from urls field
-    doomwiki_url = None
-    for url in entry.get("urls", []):
-        if "doomwiki.org" in url:
-            doomwiki_url = url
-            break
+    job = client.batches.create(
+        model=MODEL,
+        src=uploaded.name,
+        config={"display_name": "add-images-from-doomwiki"},
+    )
+    print(f"Batch job created: {job.name}")
 
-    if not doomwiki_url:
-        return False, "No DoomWiki URL"
+    terminal_states = {
+        "JOB_STATE_SUCCEEDED",
+        "JOB_STATE_FAILED",
+        "JOB_STATE_CANCELLED",
+        "JOB_STATE_EXPIRED",
+    }
+    while job.state.name not in terminal_states:
+        print(f"  State: {job.state.name}, polling again in {POLL_INTERVAL_SECONDS}s...")
+        time.sleep(POLL_INTERVAL_SECONDS)
+        job = client.batches.get(name=job.name)
+
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job ended in state {job.state.name}: {job.error}")
+
+    result_bytes = client.files.download(file=job.dest.file_name)
+    return [orjson.loads(line) for line in result_bytes.splitlines() if line.strip()]
 
-    # Skip if already has thumbnail
-    if entry.get("thumbnail"):
-        return False, "Already has thumbnail"
 
-    # Fetch and extract
-    html = fetch_page(doomwiki_url)
-    if not html:
-        return False, "Failed to fetch page"
+def parse_result_line(result: dict) -> dict:
+    """Parse the extraction JSON out of one batch result line."""
+    response = result.get("response", {})
+    candidates = response.get("candidates", [])
+    if not candidates:
+        return {"title": "", "images": []}
+    parts = candidates[0].get("content", {}).get("parts", [])
+    if not parts:
+        return {"title": "", "images": []}
+    # JSON output mode guarantees valid JSON; no fence stripping needed
+    return orjson.loads(parts[0].get("text", ""))
 
-    result = extract_images(html)
-    images = result.get("images", [])
 
+def apply_images(filepath: Path, images: list[dict], dry_run: bool = False) -> tuple[bool, str]:
+    """Apply extracted images to a WAD entry.
+
+    Returns: (updated, message)
+    """
     if not images:
         return False, "No images found"
 
+    entry = orjson.loads(filepath.read_bytes())
+
     # Find title screen for thumbnail
     thumbnail = ""
     screenshots = []
@@ -141,7 +213,9 @@ def process_wad(filepath: Path, dry_run: bool = False) -> tuple[bool, str]:
         entry["screenshots"] = screenshots
 
     if not dry_run:
-        filepath.write_text(json.dumps(entry, indent=2) + "\n")
+        filepath.write_bytes(
+            orjson.dumps(entry, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+        )
 
     return True, f"Added {1 if thumbnail else 0} thumbnail, {len(screenshots)} screenshots"
 
@@ -152,6 +226,8 @@ def main():
     parser.add_argument("--dry-run", action="store_true", help="Don't save changes")
     parser.add_argument("--skip-existing", action="store_true", default=True,
                         help="Skip entries that already have thumbnail (default: True)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore the local response cache and re-query Gemini")
     args = parser.parse_args()
 
     print("Add Images from DoomWiki")
@@ -161,16 +237,17 @@ def main():
     print()
 
     files = sorted(WADS_DIR.glob("*.json"))
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        entries = list(ex.map(lambda p: (p, orjson.loads(p.read_bytes())), files))
 
     # Filter to only entries with DoomWiki URLs
     wads_to_process = []
-    for filepath in files:
-        entry = json.loads(filepath.read_text())
+    for filepath, entry in entries:
         has_doomwiki = any("doomwiki.org" in url for url in entry.get("urls", []))
         has_thumbnail = bool(entry.get("thumbnail"))
 
         if has_doomwiki and (not has_thumbnail or not args.skip_existing):
-            wads_to_process.append(filepath)
+            wads_to_process.append((filepath, entry))
 
     if args.limit:
         wads_to_process = wads_to_process[:args.limit]
@@ -178,29 +255,54 @@ def main():
     print(f"WADs to process: {len(wads_to_process)}")
     print("=" * 60)
 
+    slug_to_file, slug_to_key, local_results = build_batch(
+        wads_to_process, use_cache=not args.no_cache
+    )
+
     updated = 0
     skipped = 0
     errors = 0
 
-    for i, filepath in enumerate(wads_to_process, 1):
-        slug = filepath.stem
-        print(f"[{i}/{len(wads_to_process)}] {slug}...", end=" ", flush=True)
-
+    def apply_result(slug: str, result: dict):
+        nonlocal updated, skipped, errors
         try:
-            success, message = process_wad(filepath, dry_run=args.dry_run)
+            images = result.get("images", [])
+            success, message = apply_images(slug_to_file[slug], images, dry_run=args.dry_run)
             if success:
                 updated += 1
-                print(f"✓ {message}")
+                print(f"  {slug}: ✓ {message}")
             else:
                 skipped += 1
-                print(f"- {message}")
+                print(f"  {slug}: - {message}")
         except Exception as e:
             errors += 1
-            print(f"✗ Error: {e}")
-
-        # Rate limit to avoid API throttling
-        if i < len(wads_to_process):
-            time.sleep(0.5)
+            print(f"  {slug}: ✗ Error: {e}")
+
+    for slug, result in local_results.items():
+        apply_result(slug, result)
+
+    to_submit = len(slug_to_file) - len(local_results)
+    if to_submit > 0:
+        print()
+        print(f"Submitting batch of {to_submit} requests ({len(local_results)} resolved locally)...")
+        client = _client()
+
+        for line in submit_batch(client):
+            slug = line.get("key", "")
+            if slug not in slug_to_file:
+                continue
+            try:
+                result = parse_result_line(line)
+            except Exception as e:
+                errors += 1
+                print(f"  {slug}: ✗ Error: {e}")
+                continue
+            cache_put(slug_to_key[slug], result)
+            apply_result(slug, result)
+    elif slug_to_file:
+        print("\nAll results served from cache, nothing to submit.")
+    else:
+        print("Nothing to submit.")
 
     print()
     print("=" * 60)
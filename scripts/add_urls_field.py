@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # /// script
 # requires-python = ">=3.11"
-# dependencies = []
+# dependencies = [
+#     "orjson",
+# ]
 # ///
 """
 Add `urls` field to all WAD entries for source attribution.
@@ -12,10 +14,13 @@ Sources:
 - Umbra: Doomworld forum thread (no wiki page exists)
 """
 
-import json
+import functools
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import orjson
+
 WADS_DIR = Path(__file__).parent.parent / "content" / "wads"
 METADATA_FILE = Path(__file__).parent / "data" / "wads_metadata.json"
 
@@ -35,12 +40,14 @@ SPECIAL_URLS = {
 }
 
 
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
+# Memoized: every title is slugified twice (metadata pass + per-file pass)
+@functools.lru_cache(maxsize=4096)
 def slugify(title: str) -> str:
     """Convert title to slug format."""
-    slug = title.lower()
-    slug = re.sub(r"[^a-z0-9]+", "-", slug)
-    slug = slug.strip("-")
-    return slug
+    return _SLUG_RE.sub("-", title.lower()).strip("-")
 
 
 def main():
@@ -50,21 +57,23 @@ def main():
     # Load metadata for wiki_url lookup
     metadata = {}
     if METADATA_FILE.exists():
-        data = json.loads(METADATA_FILE.read_text())
+        data = orjson.loads(METADATA_FILE.read_bytes())
         for wad in data.get("wads", []):
             slug = slugify(wad["title"])
             if wad.get("wiki_url"):
                 metadata[slug] = wad["wiki_url"]
         print(f"Loaded {len(metadata)} wiki URLs from metadata")
 
-    # Process all WAD entries
+    # Process all WAD entries (fan out the reads; filtering stays serial)
     files = sorted(WADS_DIR.glob("*.json"))
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        entries = list(ex.map(lambda p: (p, orjson.loads(p.read_bytes())), files))
+
     updated = 0
     skipped = 0
     errors = []
 
-    for filepath in files:
-        entry = json.loads(filepath.read_text())
+    for filepath, entry in entries:
         slug = entry.get("slug", filepath.stem)
 
         # Skip if already has urls field
@@ -96,7 +105,9 @@ def main():
 
         # Add urls field
         entry["urls"] = urls
-        filepath.write_text(json.dumps(entry, indent=2) + "\n")
+        filepath.write_bytes(
+            orjson.dumps(entry, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+        )
         updated += 1
         print(f"  {slug}: {urls[0][:50]}...")
 
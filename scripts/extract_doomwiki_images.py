@@ -2,13 +2,19 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
+#     "aiohttp",
 #     "google-genai",
+#     "orjson",
 #     "requests",
+#     "selectolax",
 # ]
 # ///
 """
 Extract images from a DoomWiki page using Gemini 3 Flash.
 
+The Gemini fallback runs on the Flex service tier (50% discount, requests
+may occasionally be shed and retried) since nothing here is interactive.
+
 Usage:
     uv run scripts/extract_doomwiki_images.py https://doomwiki.org/wiki/Ancient_Aliens
 """
@@ -17,66 +23,7 @@ import argparse
 import json
 import sys
 
-import requests
-from google import genai
-from google.genai import types
-
-PROMPT = """Analyze this DoomWiki HTML page and extract all relevant images.
-
-Return a JSON object with this structure:
-{
-  "title": "WAD title from the page",
-  "images": [
-    {
-      "type": "title_screen" | "screenshot" | "credits" | "intermission" | "other",
-      "url": "full URL to the image (use doomwiki.org domain)",
-      "caption": "description if available"
-    }
-  ]
-}
-
-Rules:
-1. Only include content images (title screens, screenshots, credits, intermission screens)
-2. SKIP: wiki logos, icons, cacoward badges, blank.gif, navigation images
-3. Convert relative URLs to absolute (prefix with https://doomwiki.org)
-4. Use the full-size image URL, not thumbnails (remove /thumb/ and size suffix like /320px-)
-5. If no content images found, return empty images array
-
-Return ONLY valid JSON, no markdown or explanation."""
-
-
-def fetch_page(url: str) -> str:
-    """Fetch HTML content from URL."""
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
-    return response.text
-
-
-def extract_images(html: str) -> dict:
-    """Use Gemini to extract image data from HTML."""
-    client = genai.Client()
-
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[f"HTML content:\n\n{html}\n\n{PROMPT}"],
-        config=types.GenerateContentConfig(
-            temperature=0.1,  # Low temperature for consistent extraction
-        ),
-    )
-
-    # Extract text from response
-    if response.candidates and response.candidates[0].content.parts:
-        text = response.candidates[0].content.parts[0].text
-        # Clean up markdown code blocks if present
-        text = text.strip()
-        if text.startswith("```"):
-            text = text.split("\n", 1)[1]  # Remove first line
-        if text.endswith("```"):
-            text = text.rsplit("```", 1)[0]  # Remove last ```
-        text = text.strip()
-        return json.loads(text)
-
-    return {"title": "", "images": []}
+from _doomwiki_common import extract_images, extract_images_fast, fetch_page
 
 
 def main():
@@ -93,7 +40,11 @@ def main():
     html = fetch_page(args.url)
     print(f"Got {len(html)} bytes, extracting images...", file=sys.stderr)
 
-    result = extract_images(html)
+    result = extract_images_fast(html)
+    if not result["images"]:
+        # Irregular page; fall back to the LLM extractor
+        print("No images found by HTML parsing, asking Gemini...", file=sys.stderr)
+        result = extract_images(html)
 
     if args.raw:
         print(json.dumps(result, indent=2))
@@ -13,46 +13,54 @@ Usage:
     uv run scripts/extract_level_names.py <wad_file> --json
 """
 
+import mmap
 import struct
 import re
 import sys
 import json
 from pathlib import Path
 
+# Precompiled patterns shared by the parsers below; the parse loops can run
+# thousands of times per lump, so avoid per-call regex-cache lookups
+_MAPINFO_RE = re.compile(r'map\s+(\w+)\s+"([^"]+)"', re.IGNORECASE)
+_SECTION_RE = re.compile(r"\[(\w+)\]")
+_LEVELNAME_RE = re.compile(r"levelname\s*=\s*(.+)", re.IGNORECASE)
+_UMAP_RE = re.compile(r"MAP\s+(\w+)", re.IGNORECASE)
+_UMAP_NAME_RE = re.compile(r'levelname\s*=\s*"?([^"]+)"?', re.IGNORECASE)
 
-def read_wad_directory(wad_path: Path) -> list[tuple[str, int, int]]:
-    """Read WAD directory and return list of (name, offset, size) tuples."""
-    with open(wad_path, "rb") as f:
-        # WAD header: 4 bytes magic, 4 bytes num_lumps, 4 bytes dir_offset
-        header = f.read(12)
-        if len(header) < 12:
-            raise ValueError("Invalid WAD file: too short")
+# Memoized per-map prefix strippers for EMAPINFO ("MAP01: Name" -> "Name")
+_PREFIX_CACHE: dict[str, re.Pattern] = {}
 
-        magic = header[:4].decode("ascii", errors="ignore")
-        if magic not in ("IWAD", "PWAD"):
-            raise ValueError(f"Invalid WAD magic: {magic}")
+# Lumps that may carry level names, as raw uppercase bytes so directory
+# entries can be filtered without decoding every name
+_MAPINFO_NAMES = frozenset({b"MAPINFO", b"ZMAPINFO", b"EMAPINFO", b"UMAPINFO"})
 
-        num_lumps, dir_offset = struct.unpack("<II", header[4:12])
 
-        # Read directory
-        f.seek(dir_offset)
-        entries = []
-        for _ in range(num_lumps):
-            entry = f.read(16)
-            if len(entry) < 16:
-                break
-            offset, size = struct.unpack("<II", entry[:8])
-            name = entry[8:16].rstrip(b"\x00").decode("ascii", errors="ignore")
-            entries.append((name, offset, size))
+def _iter_mapinfo_lumps(mm: mmap.mmap):
+    """Yield (name, offset, size) for MAPINFO-family lumps in the directory.
 
-        return entries
+    The filter lives in the producer: non-matching entries are discarded
+    straight off the iter_unpack stream (an 8-byte compare each) without
+    building an intermediate list or decoding any names.
+    """
+    # WAD header: 4 bytes magic, 4 bytes num_lumps, 4 bytes dir_offset
+    if len(mm) < 12:
+        raise ValueError("Invalid WAD file: too short")
 
+    magic = mm[:4].decode("ascii", errors="ignore")
+    if magic not in ("IWAD", "PWAD"):
+        raise ValueError(f"Invalid WAD magic: {magic}")
 
-def read_lump(wad_path: Path, offset: int, size: int) -> bytes:
-    """Read lump data from WAD file."""
-    with open(wad_path, "rb") as f:
-        f.seek(offset)
-        return f.read(size)
+    num_lumps, dir_offset = struct.unpack("<II", mm[4:12])
+
+    # Slice the whole directory in one go and let struct iterate it in C
+    # instead of doing one read + unpack per entry
+    blob = mm[dir_offset : dir_offset + 16 * num_lumps]
+    blob = memoryview(blob)[: 16 * (len(blob) // 16)]
+    for offset, size, name_bytes in struct.iter_unpack("<II8s", blob):
+        lump_name = name_bytes.upper().rstrip(b"\x00")
+        if lump_name in _MAPINFO_NAMES and size > 0:
+            yield lump_name.decode("ascii"), offset, size
 
 
 def parse_mapinfo(content: str) -> dict[str, str]:
@@ -64,8 +72,7 @@ def parse_mapinfo(content: str) -> dict[str, str]:
 
     # Pattern: map MAP01 "Level Name" or map MAP01 lookup "HUSTR_E1M1"
     # Also handles: map MAP01 "Level Name" {}
-    pattern = r'map\s+(\w+)\s+"([^"]+)"'
-    for match in re.finditer(pattern, content, re.IGNORECASE):
+    for match in _MAPINFO_RE.finditer(content):
         map_id = match.group(1).upper()
         level_name = match.group(2)
         levels[map_id] = level_name
@@ -87,18 +94,23 @@ def parse_emapinfo(content: str) -> dict[str, str]:
         line = line.strip()
 
         # Check for [MAP01] section header
-        section_match = re.match(r"\[(\w+)\]", line)
+        section_match = _SECTION_RE.match(line)
         if section_match:
             current_map = section_match.group(1).upper()
             continue
 
         # Check for levelname = value
         if current_map:
-            name_match = re.match(r"levelname\s*=\s*(.+)", line, re.IGNORECASE)
+            name_match = _LEVELNAME_RE.match(line)
             if name_match:
                 level_name = name_match.group(1).strip()
                 # Remove MAP01: prefix if present
-                level_name = re.sub(r"^" + current_map + r":\s*", "", level_name)
+                prefix_re = _PREFIX_CACHE.get(current_map)
+                if prefix_re is None:
+                    prefix_re = _PREFIX_CACHE[current_map] = re.compile(
+                        r"^" + current_map + r":\s*"
+                    )
+                level_name = prefix_re.sub("", level_name)
                 levels[current_map] = level_name
 
     return levels
@@ -120,14 +132,14 @@ def parse_umapinfo(content: str) -> dict[str, str]:
         line = line.strip()
 
         # Check for MAP MAP01
-        map_match = re.match(r"MAP\s+(\w+)", line, re.IGNORECASE)
+        map_match = _UMAP_RE.match(line)
         if map_match:
             current_map = map_match.group(1).upper()
             continue
 
         # Check for levelname = "value" or levelname = value
         if current_map:
-            name_match = re.match(r'levelname\s*=\s*"?([^"]+)"?', line, re.IGNORECASE)
+            name_match = _UMAP_NAME_RE.match(line)
             if name_match:
                 level_name = name_match.group(1).strip()
                 levels[current_map] = level_name
@@ -137,32 +149,30 @@ def parse_umapinfo(content: str) -> dict[str, str]:
 
 def extract_level_names(wad_path: Path) -> dict[str, str]:
     """Extract level names from a WAD file."""
-    entries = read_wad_directory(wad_path)
     levels = {}
 
-    # Look for MAPINFO-style lumps
-    mapinfo_lumps = ["MAPINFO", "ZMAPINFO", "EMAPINFO", "UMAPINFO"]
-
-    for name, offset, size in entries:
-        if name.upper() in mapinfo_lumps and size > 0:
-            try:
-                data = read_lump(wad_path, offset, size)
-                content = data.decode("utf-8", errors="ignore")
-
-                if name.upper() == "EMAPINFO":
-                    parsed = parse_emapinfo(content)
-                elif name.upper() == "UMAPINFO":
-                    parsed = parse_umapinfo(content)
-                else:
-                    parsed = parse_mapinfo(content)
-
-                # Merge, preferring earlier lumps
-                for map_id, level_name in parsed.items():
-                    if map_id not in levels:
-                        levels[map_id] = level_name
-
-            except Exception as e:
-                print(f"Warning: Failed to parse {name}: {e}", file=sys.stderr)
+    # Open and map the file once; lumps are sliced straight from the mapping
+    # instead of re-opening the file for every read
+    with open(wad_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for name, offset, size in _iter_mapinfo_lumps(mm):
+                try:
+                    content = mm[offset : offset + size].decode("utf-8", errors="ignore")
+
+                    if name == "EMAPINFO":
+                        parsed = parse_emapinfo(content)
+                    elif name == "UMAPINFO":
+                        parsed = parse_umapinfo(content)
+                    else:
+                        parsed = parse_mapinfo(content)
+
+                    # Merge, preferring earlier lumps
+                    for map_id, level_name in parsed.items():
+                        if map_id not in levels:
+                            levels[map_id] = level_name
+
+                except Exception as e:
+                    print(f"Warning: Failed to parse {name}: {e}", file=sys.stderr)
 
     return levels
 
@@ -2,8 +2,12 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
+#     "aiohttp",
+#     "aiolimiter",
 #     "google-genai",
+#     "orjson",
 #     "requests",
+#     "selectolax",
 # ]
 # ///
 """
@@ -11,8 +15,12 @@ Extract comprehensive WAD metadata by crawling DoomWiki pages.
 
 1. Fetches main wiki page
 2. Uses Gemini to find relevant sub-links
-3. Fetches each linked page
-4. Passes all content to Gemini to extract structured metadata
+3. Fetches all linked pages concurrently
+4. Condenses each subpage with a cheap per-page Gemini call
+5. Passes the main page plus the small summaries to Gemini for final metadata
+
+Gemini calls use the Flex service tier: half price, at the cost of
+occasional sheddable failures - fine for a rerunnable enrichment script.
 
 Usage:
     uv run scripts/extract_wad_metadata.py https://doomwiki.org/wiki/Ancient_Aliens
@@ -20,13 +28,30 @@ Usage:
 """
 
 import argparse
-import json
+import asyncio
 import sys
 from pathlib import Path
 
-import requests
-from google import genai
-from google.genai import types
+import aiohttp
+import orjson
+from aiolimiter import AsyncLimiter
+
+from _doomwiki_common import (
+    FETCH_CONCURRENCY,
+    _client,
+    cache_get,
+    cache_key,
+    cache_put,
+    cached_generate,
+    fetch_page_async,
+)
+
+# Published RPM for the project's Gemini tier; raise to match your billing tier
+GEMINI_RPM = 10
+
+# Token bucket sized just under the tier limit, so calls flow at full rate
+# instead of sleeping a fixed worst-case delay between requests
+_LIMITER = AsyncLimiter(max_rate=GEMINI_RPM - 1, time_period=60)
 
 LINK_EXTRACTION_PROMPT = """Analyze this DoomWiki HTML page for a Doom WAD/mod.
 
@@ -54,13 +79,25 @@ Return a JSON object:
       "description": "brief description of what this page contains"
     }
   ]
+}"""
+
+SUBPAGE_SUMMARY_PROMPT = """You are analyzing one DoomWiki subpage about a Doom WAD/mod.
+
+Condense it into a compact summary that preserves everything useful for
+building WAD metadata: difficulty remarks, themes, custom content (monsters,
+weapons, music, textures), map counts, authors, years, notable trivia.
+
+Return a JSON object:
+{
+  "summary": "3-5 sentence summary of this page",
+  "facts": ["short", "standalone", "facts", "worth", "keeping"]
 }
 
-Return ONLY valid JSON, no markdown or explanation."""
+Keep the whole result under about 1 KB. Omit walkthrough details."""
 
 METADATA_EXTRACTION_PROMPT = """You are analyzing DoomWiki content about a Doom WAD/mod.
 
-I will provide the HTML content from multiple wiki pages about this WAD. Extract comprehensive metadata.
+I will provide the main wiki page plus condensed summaries of its subpages. Extract comprehensive metadata.
 
 Return a JSON object with this structure:
 {
@@ -95,114 +132,211 @@ Guidelines for tags:
 - atmosphere_tags: atmospheric, colorful, dark, creepy, beautiful, surreal, retro, modern, etc.
 
 Be accurate - only include information that is explicitly stated or strongly implied in the content.
-If information is not available, use null or empty arrays.
+If information is not available, use null or empty arrays."""
 
-Return ONLY valid JSON, no markdown or explanation."""
 
+# Response schemas enforced by Gemini's JSON output mode
+SUBPAGE_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "facts": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["summary", "facts"],
+}
 
-def fetch_page(url: str) -> str | None:
-    """Fetch HTML content from URL."""
-    try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"  Error fetching {url}: {e}", file=sys.stderr)
-        return None
+LINKS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "wad_title": {"type": "STRING"},
+        "links": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "url": {"type": "STRING"},
+                    "description": {"type": "STRING"},
+                },
+                "required": ["url"],
+            },
+        },
+    },
+    "required": ["wad_title", "links"],
+}
+
+METADATA_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "difficulty": {
+            "type": "STRING",
+            "enum": ["easy", "medium", "hard", "slaughter", "varies"],
+        },
+        "difficulty_notes": {"type": "STRING"},
+        "themes": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "gameplay_tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "atmosphere_tags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "features": {
+            "type": "OBJECT",
+            "properties": {
+                "custom_monsters": {"type": "BOOLEAN"},
+                "custom_weapons": {"type": "BOOLEAN"},
+                "custom_music": {"type": "BOOLEAN"},
+                "custom_textures": {"type": "BOOLEAN"},
+                "story_driven": {"type": "BOOLEAN"},
+                "puzzle_elements": {"type": "BOOLEAN"},
+            },
+        },
+        "map_count": {"type": "INTEGER", "nullable": True},
+        "estimated_playtime": {"type": "STRING", "nullable": True},
+        "recommended_skill": {"type": "STRING"},
+        "notable_for": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "similar_to": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "warnings": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "year": {"type": "INTEGER", "nullable": True},
+        "authors": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+}
 
 
-def extract_links(html: str) -> dict:
+async def extract_links(html: str, use_cache: bool = True) -> dict:
     """Use Gemini to extract relevant links from the main page."""
-    client = genai.Client()
-
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[f"HTML content:\n\n{html}\n\n{LINK_EXTRACTION_PROMPT}"],
-        config=types.GenerateContentConfig(
-            temperature=0.1,
-        ),
-    )
+    key = cache_key(LINK_EXTRACTION_PROMPT, html)
+    if use_cache:
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
 
-    if response.candidates and response.candidates[0].content.parts:
-        text = response.candidates[0].content.parts[0].text
-        text = text.strip()
-        if text.startswith("```"):
-            text = text.split("\n", 1)[1]
-        if text.endswith("```"):
-            text = text.rsplit("```", 1)[0]
-        text = text.strip()
-        return json.loads(text)
+    client = _client()
+
+    async with _LIMITER:
+        text = await asyncio.to_thread(
+            cached_generate, client, LINK_EXTRACTION_PROMPT, f"HTML content:\n\n{html}", LINKS_SCHEMA
+        )
+
+    # JSON output mode guarantees valid JSON; no fence stripping needed
+    if text:
+        result = orjson.loads(text)
+        cache_put(key, result)
+        return result
 
     return {"wad_title": "", "links": []}
 
 
-def extract_metadata(combined_content: str) -> dict:
-    """Use Gemini to extract structured metadata from all page content."""
-    client = genai.Client()
-
-    response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=[f"Combined wiki content:\n\n{combined_content}\n\n{METADATA_EXTRACTION_PROMPT}"],
-        config=types.GenerateContentConfig(
-            temperature=0.1,
-        ),
-    )
+async def summarize_subpage(html: str, use_cache: bool = True) -> dict:
+    """Use Gemini to condense one subpage into a ~1 KB summary."""
+    key = cache_key(SUBPAGE_SUMMARY_PROMPT, html)
+    if use_cache:
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
 
-    if response.candidates and response.candidates[0].content.parts:
-        text = response.candidates[0].content.parts[0].text
-        text = text.strip()
-        if text.startswith("```"):
-            text = text.split("\n", 1)[1]
-        if text.endswith("```"):
-            text = text.rsplit("```", 1)[0]
-        text = text.strip()
-        return json.loads(text)
+    client = _client()
 
-    return {}
+    async with _LIMITER:
+        text = await asyncio.to_thread(
+            cached_generate,
+            client,
+            SUBPAGE_SUMMARY_PROMPT,
+            f"HTML content:\n\n{html}",
+            SUBPAGE_SUMMARY_SCHEMA,
+        )
 
+    if text:
+        result = orjson.loads(text)
+        cache_put(key, result)
+        return result
 
-def process_wad(url: str, max_subpages: int = 10) -> dict:
-    """Process a WAD's wiki page and extract comprehensive metadata."""
-    print(f"Fetching main page: {url}", file=sys.stderr)
-    main_html = fetch_page(url)
-    if not main_html:
-        return {"error": "Failed to fetch main page"}
+    return {"summary": "", "facts": []}
 
-    print(f"  Got {len(main_html)} bytes", file=sys.stderr)
 
-    # Extract links to subpages
-    print("Extracting links to subpages...", file=sys.stderr)
-    links_result = extract_links(main_html)
-    links = links_result.get("links", [])
-    print(f"  Found {len(links)} relevant links", file=sys.stderr)
+async def extract_metadata(combined_content: str, use_cache: bool = True) -> dict:
+    """Use Gemini to extract structured metadata from all page content."""
+    key = cache_key(METADATA_EXTRACTION_PROMPT, combined_content)
+    if use_cache:
+        cached = cache_get(key)
+        if cached is not None:
+            return cached
+
+    client = _client()
+
+    async with _LIMITER:
+        text = await asyncio.to_thread(
+            cached_generate,
+            client,
+            METADATA_EXTRACTION_PROMPT,
+            f"Combined wiki content:\n\n{combined_content}",
+            METADATA_SCHEMA,
+        )
+
+    # JSON output mode guarantees valid JSON; no fence stripping needed
+    if text:
+        result = orjson.loads(text)
+        cache_put(key, result)
+        return result
 
-    # Collect all page content
-    all_content = [f"=== MAIN PAGE: {url} ===\n\n{main_html}"]
+    return {}
 
-    # Fetch subpages (limit to avoid too many requests)
-    links_to_fetch = links[:max_subpages]
-    for i, link in enumerate(links_to_fetch, 1):
-        link_url = link.get("url", "")
-        if not link_url:
-            continue
 
-        # Ensure full URL
-        if link_url.startswith("/"):
-            link_url = f"https://doomwiki.org{link_url}"
+async def process_wad(url: str, max_subpages: int = 10, use_cache: bool = True) -> dict:
+    """Process a WAD's wiki page and extract comprehensive metadata."""
+    sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+    async with aiohttp.ClientSession() as session:
+        print(f"Fetching main page: {url}", file=sys.stderr)
+        main_html = await fetch_page_async(session, url, sem)
+        if not main_html:
+            return {"error": "Failed to fetch main page"}
+
+        print(f"  Got {len(main_html)} bytes", file=sys.stderr)
+
+        # Extract links to subpages
+        print("Extracting links to subpages...", file=sys.stderr)
+        links_result = await extract_links(main_html, use_cache=use_cache)
+        links = links_result.get("links", [])
+        print(f"  Found {len(links)} relevant links", file=sys.stderr)
+
+        # Fetch subpages concurrently (limit to avoid too many requests)
+        links_to_fetch = links[:max_subpages]
+        subpage_urls = []
+        for link in links_to_fetch:
+            link_url = link.get("url", "")
+            if not link_url:
+                continue
+            # Ensure full URL
+            if link_url.startswith("/"):
+                link_url = f"https://doomwiki.org{link_url}"
+            subpage_urls.append(link_url)
+
+        print(f"  Fetching {len(subpage_urls)} subpages...", file=sys.stderr)
+        htmls = await asyncio.gather(
+            *[fetch_page_async(session, link_url, sem) for link_url in subpage_urls]
+        )
+
+    # Condense each subpage to ~1 KB with cheap parallel calls, so the final
+    # extraction sees the main page plus small summaries instead of hundreds
+    # of KB of concatenated HTML
+    fetched = [(link_url, html) for link_url, html in zip(subpage_urls, htmls) if html]
+    print(f"  Summarizing {len(fetched)} subpages...", file=sys.stderr)
+    summaries = await asyncio.gather(
+        *[summarize_subpage(html, use_cache=use_cache) for _, html in fetched]
+    )
 
-        print(f"  [{i}/{len(links_to_fetch)}] Fetching: {link_url}", file=sys.stderr)
-        html = fetch_page(link_url)
-        if html:
-            all_content.append(f"=== SUBPAGE: {link_url} ===\n\n{html}")
-            print(f"    Got {len(html)} bytes", file=sys.stderr)
+    all_content = [f"=== MAIN PAGE: {url} ===\n\n{main_html}"]
+    for (link_url, _), summary in zip(fetched, summaries):
+        all_content.append(
+            f"=== SUBPAGE SUMMARY: {link_url} ===\n\n"
+            + orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode()
+        )
 
-    # Combine all content
+    # Combine the main page with the per-subpage summaries
     combined = "\n\n".join(all_content)
     print(f"\nTotal content: {len(combined)} bytes from {len(all_content)} pages", file=sys.stderr)
 
     # Extract metadata from combined content
     print("Extracting metadata with Gemini...", file=sys.stderr)
-    metadata = extract_metadata(combined)
+    metadata = await extract_metadata(combined, use_cache=use_cache)
 
     # Add source info
     metadata["_source_url"] = url
@@ -217,15 +351,19 @@ def main():
     parser.add_argument("url", help="DoomWiki URL to process")
     parser.add_argument("--output", "-o", help="Output file path (default: stdout)")
     parser.add_argument("--max-subpages", type=int, default=10, help="Maximum subpages to fetch (default: 10)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore the local response cache and re-query Gemini")
     args = parser.parse_args()
 
     if "doomwiki.org" not in args.url:
         print("Error: URL must be a doomwiki.org page", file=sys.stderr)
         sys.exit(1)
 
-    result = process_wad(args.url, max_subpages=args.max_subpages)
+    result = asyncio.run(
+        process_wad(args.url, max_subpages=args.max_subpages, use_cache=not args.no_cache)
+    )
 
-    output = json.dumps(result, indent=2)
+    output = orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
 
     if args.output:
         Path(args.output).write_text(output + "\n")